@@ -1,9 +1,11 @@
 from __future__ import annotations
 import random
+import sys
 import numpy as np
+from numba import njit
 from blessed import Terminal, keyboard
 from collections import namedtuple
-from typing import Optional, List
+from typing import Optional, Tuple
 
 term = Terminal()
 
@@ -17,84 +19,95 @@ SYMBOLS = {
     'FLAGGED': 'X',
 }
 
+# Symbol code for a revealed safe cell, indexed by its adjacent mine count
+MINE_COUNT_SYMBOLS = np.frombuffer((SYMBOLS['EMPTY'] + '12345678').encode('ascii'), dtype=np.uint8)
+
+# Bits of Minefield.state
+MINE_BIT = 1
+REVEALED_BIT = 2
+FLAGGED_BIT = 4
+
+DIGIT_COLORS = {
+    '1': term.steelblue,
+    '2': term.green,
+    '3': term.red,
+    '4': term.yellow,
+    '5': term.aqua,
+    '6': term.springgreen,
+    '7': term.mediumorchid,
+    '8': term.orangered
+}
 
-class Cell:
-    def __init__(self, minefield: Minefield, position: Position, plant_mine: bool = False) -> None:
-        self.minefield = minefield
-        self.position = position
-        self.is_mine = plant_mine
-        self.is_flagged = False
-        self.is_revealed = False
-        self.clicked_auto_reveal = False
-        self.symbol = SYMBOLS['UNREVEALED']
-
-    def neighbours(self) -> List[Cell]:
-        neighbours = []
-        directions = [(-1, -1), (-1, +0), (-1, +1), (+0, -1), (+0, +1), (+1, -1), (+1, +0), (+1, +1)]
-        for dx, dy in directions:
-            nx, ny = self.position.x + dx, self.position.y + dy
-            if 0 <= nx < self.minefield.size.width and 0 <= ny < self.minefield.size.height:
-                neighbours.append(self.minefield.cells[nx, ny])
-        return neighbours
-
-    def reveal(self, visited=None) -> None:
-        # There is still some weird behaviour i cannot explain where its unpredictable where neigbours neighbours
-        # will auto discover nearby
-        if visited is None:
-            visited = set()
-
-        if self.is_flagged:
-            return
-
-        visited.add(self)
+# str.translate table that wraps every digit in its color
+STYLED_SYMBOLS = {ord(digit): color + digit + term.normal for digit, color in DIGIT_COLORS.items()}
+# Encoded, styled output for every symbol code
+STYLED_SYMBOL_BYTES = [chr(code).translate(STYLED_SYMBOLS).encode() for code in range(128)]
+# The same, highlighted for the cell under the cursor
+CURSOR_SYMBOL_BYTES = [term.on_gray(chr(code).translate(STYLED_SYMBOLS)).encode() for code in range(128)]
 
-        if self.is_revealed:
+# (dy, dx) offsets to the eight neighbours of a cell
+DIRECTIONS = [(-1, -1), (-1, +0), (-1, +1), (+0, -1), (+0, +1), (+1, -1), (+1, +0), (+1, +1)]
 
-            # Check if the number of flagged neighbors matches the cell's number
-            mine_count = sum(neighbour.is_mine for neighbour in self.neighbours())
-            flagged_count = sum(neighbour.is_flagged for neighbour in self.neighbours())
-            if mine_count == flagged_count and not self.clicked_auto_reveal:
-                self.clicked_auto_reveal = True
-                for neighbour in self.neighbours():
-                    if not neighbour.is_flagged and neighbour not in visited:
-                        neighbour.reveal(visited)
-            return
 
-        self.is_revealed = True
-        if self.is_mine:
-            self.symbol = SYMBOLS['MINE']
-        else:
-            mine_count = sum(neighbour.is_mine for neighbour in self.neighbours())
-            self.symbol = str(mine_count) if mine_count > 0 else SYMBOLS['EMPTY']
-            if mine_count == 0:
-                for neighbour in self.neighbours():
-                    if neighbour not in visited:
-                        neighbour.reveal()
-
-    def flag(self) -> None:
-        if not self.is_revealed:
-            if self.is_flagged:
-                self.is_flagged = False
-                self.symbol = SYMBOLS['UNREVEALED']
-            else:
-                self.is_flagged = True
-                self.symbol = SYMBOLS['FLAGGED']
+class Cell:
+    # Short-lived read-only view onto one cell of a Minefield's arrays; the minefield keeps no Cell objects
+    __slots__ = ('minefield', 'x', 'y')
 
-    def __str__(self) -> str:
-        if self.symbol.isdigit():  # If the symbol is a number
-            colors = {
-                '1': term.steelblue,
-                '2': term.green,
-                '3': term.red,
-                '4': term.yellow,
-                '5': term.aqua,
-                '6': term.springgreen,
-                '7': term.mediumorchid,
-                '8': term.orangered
-            }
-            return colors.get(self.symbol, '') + self.symbol + term.normal
-        else:
-            return self.symbol
+    def __init__(self, minefield: Minefield, x: int, y: int) -> None:
+        self.minefield = minefield
+        self.x = x
+        self.y = y
+
+    @property
+    def is_mine(self) -> bool:
+        return bool(self.minefield.state[self.minefield.cell_id(self.x, self.y)] & MINE_BIT)
+
+    @property
+    def is_flagged(self) -> bool:
+        return bool(self.minefield.state[self.minefield.cell_id(self.x, self.y)] & FLAGGED_BIT)
+
+    @property
+    def is_revealed(self) -> bool:
+        return bool(self.minefield.state[self.minefield.cell_id(self.x, self.y)] & REVEALED_BIT)
+
+
+def format_symbol(symbol: str) -> str:
+    return symbol.translate(STYLED_SYMBOLS)
+
+
+def build_morton_lut(width: int, height: int) -> np.ndarray:
+    # Interleave the bits of x and y (x in the even bits) to get each cell's Z-order code
+    codes = []
+    for coordinate in np.indices((height, width), dtype=np.uint32)[::-1]:
+        for shift, mask in [(8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)]:
+            coordinate = (coordinate | (coordinate << shift)) & mask
+        codes.append(coordinate)
+    morton_codes = codes[0] | (codes[1] << 1)
+    # Boards are rarely square powers of two, so rank the codes to close the gaps between them
+    lut = np.empty(width * height, dtype=np.int32)
+    lut[np.argsort(morton_codes, axis=None)] = np.arange(width * height, dtype=np.int32)
+    return lut.reshape(height, width)
+
+
+@njit(cache=True)
+def flood_fill(start_id, state, adj, neighbour_ids):
+    # Breadth-first over a preallocated queue; cells are marked revealed as they are enqueued so each one is
+    # enqueued at most once, which leaves exactly the newly revealed ids in queue[:tail]
+    queue = np.empty(state.size, dtype=np.int32)
+    queue[0] = start_id
+    state[start_id] |= REVEALED_BIT
+    head, tail = 0, 1
+    while head < tail:
+        cell_id = queue[head]
+        head += 1
+        if adj[cell_id] != 0 or state[cell_id] & MINE_BIT:
+            continue
+        for neighbour_id in neighbour_ids[cell_id]:
+            if neighbour_id >= 0 and not state[neighbour_id] & (REVEALED_BIT | FLAGGED_BIT):
+                state[neighbour_id] |= REVEALED_BIT
+                queue[tail] = neighbour_id
+                tail += 1
+    return queue[:tail]
 
 
 class Minefield:
@@ -102,20 +115,66 @@ class Minefield:
         self.top_left = top_left
         self.size = size
         self.num_mines = num_mines
-        self.cells = np.empty(shape=(self.size.width, self.size.height), dtype=object)
-        self.cursor_position = self.top_left
-
-        mine_positions = self.__place_mines()
-
-        for x in range(self.size.width):
-            for y in range(self.size.height):
-                cell_position = Position(x=x, y=y)
-                plant_mine = cell_position in mine_positions
-                self.cells[x, y] = Cell(self, cell_position, plant_mine)
+        self.cursor_x = 0
+        self.cursor_y = 0
+
+        # All per-cell state is stored in flat arrays indexed by cell id, see cell_id().
+        # Cell ids follow Z-order so that the rows above and below a cell get ids close to its own
+        num_cells = self.size.width * self.size.height
+        self.__morton_lut = build_morton_lut(self.size.width, self.size.height)
+        self.__cell_ys, self.__cell_xs = np.unravel_index(
+            np.argsort(self.__morton_lut, axis=None), self.__morton_lut.shape
+        )
+        self.state = np.zeros(num_cells, dtype=np.uint8)
+        self.symbol_code = np.full(num_cells, ord(SYMBOLS['UNREVEALED']), dtype=np.uint8)
+        # Cells whose symbol (or cursor highlight) changed since the last render_diff
+        self.__dirty_cells = set()
+
+        # Escape sequence that moves the terminal cursor onto each cell, by cell id
+        self.__move_sequences = [
+            term.move_xy(self.top_left.x + x, self.top_left.y + y).encode()
+            for x, y in zip(self.__cell_xs.tolist(), self.__cell_ys.tolist())
+        ]
+
+        self.neighbour_ids = self.__build_neighbour_ids()
+        self.__place_mines()
+        self.adj = self.__count_adjacent_mines()
+        # Safe cells still hidden; the game is won when this reaches zero
+        self.unrevealed_safe = num_cells - self.num_mines
+        # Number of flagged neighbours per cell, kept up to date by flag()
+        self.adj_flagged = np.zeros_like(self.adj)
+
+    def cell(self, x: int, y: int) -> Cell:
+        return Cell(self, x, y)
+
+    def cell_id(self, x: int, y: int) -> int:
+        return int(self.__morton_lut[y, x])
+
+    def position(self, cell_id: int) -> Tuple[int, int]:
+        return int(self.__cell_xs[cell_id]), int(self.__cell_ys[cell_id])
+
+    def __build_neighbour_ids(self) -> np.ndarray:
+        # One row of 8 neighbour ids per cell, -1 where the neighbour would fall off the board
+        width, height = self.size
+        xs, ys = self.__cell_xs, self.__cell_ys
+        neighbour_ids = np.full((width * height, len(DIRECTIONS)), -1, dtype=np.int32)
+        for i, (dy, dx) in enumerate(DIRECTIONS):
+            nx, ny = xs + dx, ys + dy
+            in_bounds = (0 <= nx) & (nx < width) & (0 <= ny) & (ny < height)
+            neighbour_ids[in_bounds, i] = self.__morton_lut[ny[in_bounds], nx[in_bounds]]
+        # Ascending ids (sentinels first) so the flood fill enqueues each neighbourhood in memory order
+        neighbour_ids.sort(axis=1)
+        return neighbour_ids
+
+    def __count_adjacent_mines(self) -> np.ndarray:
+        # The appended 0 is what the -1 sentinels index, so off-board neighbours never count
+        mines = np.append(self.state & MINE_BIT, 0)
+        return mines[self.neighbour_ids].sum(axis=1, dtype=np.uint8)
 
     def move_cursor(self, dx: int = 0, dy: int = 0) -> None:
+        self.__dirty_cells.add(self.cell_id(self.cursor_x, self.cursor_y))
 
-        new_x, new_y = self.cursor_position.x + dx, self.cursor_position.y + dy
+        new_x, new_y = self.cursor_x + dx, self.cursor_y + dy
         min_x, min_y, max_x, max_y = 0, 0, self.size.width - 1, self.size.height - 1
 
         if new_x > max_x:
@@ -127,45 +186,83 @@ class Minefield:
         elif new_y < min_y:
             new_y = min_y
 
-        self.cursor_position = Position(
-            new_x, new_y
-        )
+        self.cursor_x, self.cursor_y = new_x, new_y
 
-    def __place_mines(self) -> List[Position]:
-        mine_positions = []
-        while len(mine_positions) < self.num_mines:
-            new_mine_position = Position(
-                x=random.randint(a=0, b=self.size.width - 1),
-                y=random.randint(a=0, b=self.size.height - 1)
-            )
-            if new_mine_position not in mine_positions:
-                mine_positions.append(new_mine_position)
-        return mine_positions
-
-    def reveal(self, position: Position) -> None:
-        cell = self.cells[position.x, position.y]
-        cell.reveal()
+    def __place_mines(self) -> None:
+        num_cells = self.size.width * self.size.height
+        mine_ids = np.random.default_rng().choice(num_cells, size=self.num_mines, replace=False)
+        self.state[mine_ids] |= MINE_BIT
 
-    def reveal_all(self) -> None:
-        for x in range(self.size.width):
-            for y in range(self.size.height):
-                cell = self.cells[x, y]
-                cell.reveal()
+    def reveal(self, x: int, y: int) -> None:
+        cell_id = self.cell_id(x, y)
+        if self.state[cell_id] & FLAGGED_BIT:
+            return
+
+        if self.state[cell_id] & REVEALED_BIT:
+            # Chord: once the number of flagged neighbours matches the cell's number, open the rest
+            if self.adj[cell_id] == self.adj_flagged[cell_id]:
+                for neighbour_id in self.neighbour_ids[cell_id].tolist():
+                    if neighbour_id >= 0 and not self.state[neighbour_id] & (REVEALED_BIT | FLAGGED_BIT):
+                        self.flood_reveal(neighbour_id)
+            return
 
-    def flag(self, position: Position) -> None:
-        self.cells[position.x, position.y].flag()
+        self.flood_reveal(cell_id)
+
+    def flood_reveal(self, cell_id: int) -> None:
+        revealed_ids = flood_fill(cell_id, self.state, self.adj, self.neighbour_ids)
+        self.__apply_reveal(revealed_ids)
+
+    def __apply_reveal(self, cell_ids: np.ndarray) -> None:
+        # Bookkeeping for a batch of cells that just became revealed
+        self.unrevealed_safe -= int(np.count_nonzero((self.state[cell_ids] & MINE_BIT) == 0))
+        self.__dirty_cells.update(cell_ids.tolist())
+        self.symbol_code[cell_ids] = np.where(
+            self.state[cell_ids] & MINE_BIT, ord(SYMBOLS['MINE']), MINE_COUNT_SYMBOLS[self.adj[cell_ids]]
+        )
+
+    def reveal_all(self) -> None:
+        # Flagged cells keep their flag, as with a regular reveal
+        hidden_ids = np.flatnonzero((self.state & (REVEALED_BIT | FLAGGED_BIT)) == 0)
+        self.state[hidden_ids] |= REVEALED_BIT
+        self.__apply_reveal(hidden_ids)
+
+    def flag(self, x: int, y: int) -> None:
+        cell_id = self.cell_id(x, y)
+        if not self.state[cell_id] & REVEALED_BIT:
+            self.__dirty_cells.add(cell_id)
+            self.state[cell_id] ^= FLAGGED_BIT
+            neighbour_ids = self.neighbour_ids[cell_id]
+            neighbour_ids = neighbour_ids[neighbour_ids >= 0]
+            if self.state[cell_id] & FLAGGED_BIT:
+                self.symbol_code[cell_id] = ord(SYMBOLS['FLAGGED'])
+                self.adj_flagged[neighbour_ids] += 1
+            else:
+                self.symbol_code[cell_id] = ord(SYMBOLS['UNREVEALED'])
+                self.adj_flagged[neighbour_ids] -= 1
 
     def all_cells_revealed_except_mines(self) -> bool:
-        for x in range(self.size.width):
-            for y in range(self.size.height):
-                cell = self.cells[x, y]
-                if not cell.is_revealed and not cell.is_mine:
-                    return False
-        return True
+        return not bool(((self.state & (MINE_BIT | REVEALED_BIT)) == 0).any())
 
     def __str__(self) -> str:
-        return '\n'.join(
-            ''.join(str(self.cells[x, y]) for x in range(self.size.width)) for y in range(self.size.height)
+        buffer = np.empty((self.size.height, self.size.width + 1), dtype=np.uint8)
+        buffer[:, :-1] = self.symbol_code[self.__morton_lut]
+        buffer[:, -1] = ord('\n')
+        # Drop the trailing newline of the last row
+        return format_symbol(buffer.tobytes()[:-1].decode('ascii'))
+
+    def render_cursor(self) -> bytes:
+        cell_id = self.cell_id(self.cursor_x, self.cursor_y)
+        return self.__move_sequences[cell_id] + CURSOR_SYMBOL_BYTES[self.symbol_code[cell_id]]
+
+    def clear_dirty(self) -> None:
+        self.__dirty_cells.clear()
+
+    def render_diff(self) -> bytes:
+        dirty_ids = list(self.__dirty_cells)
+        self.__dirty_cells.clear()
+        return b''.join(
+            self.__move_sequences[cell_id] + STYLED_SYMBOL_BYTES[symbol_code]
+            for cell_id, symbol_code in zip(dirty_ids, self.symbol_code[dirty_ids].tolist())
         )
 
 
@@ -193,19 +290,24 @@ class InputHandler:
             'FLAG': ['F', '0'],
             'REVEAL': ['R', '5'],
         }
+        # Inverted lookups: special keys match on keystroke.code, everything else on the upper-cased character
+        self.code_to_action = {}
+        self.character_to_action = {}
+        for action, keystrokes in self.action_to_keystrokes.items():
+            for keystroke in keystrokes:
+                if isinstance(keystroke, int):
+                    self.code_to_action[keystroke] = action
+                else:
+                    self.character_to_action[keystroke] = action
 
     def get_input(self) -> Optional[str]:
         keystroke: keyboard.Keystroke = term.inkey(timeout=1)
 
-        for action, keystrokes in self.action_to_keystrokes.items():
-            if keystroke.upper() in keystrokes or keystroke.code in keystrokes:
-                return action
-
-        return None
+        return self.code_to_action.get(keystroke.code) or self.character_to_action.get(keystroke.upper())
 
 
 def main() -> None:
-    print(term.clear)
+    print(term.clear, flush=True)
 
     size = Size(width=90, height=21)
     num_mines = 250
@@ -214,32 +316,29 @@ def main() -> None:
     minesweeper = Minesweeper(minefield)
     ##########
     # Find all empty cells in the minefield
-    empty_cells = []
-    for x in range(minefield.size.width):
-        for y in range(minefield.size.height):
-            cell = minefield.cells[x, y]
-            if not cell.is_revealed and not cell.is_mine:
-                mine_count = sum(neighbour.is_mine for neighbour in cell.neighbours())
-                if mine_count == 0:
-                    empty_cells.append(cell)
+    empty_cells = np.flatnonzero((minefield.adj == 0) & ((minefield.state & (MINE_BIT | REVEALED_BIT)) == 0))
     # Choose a random empty cell and reveal it
-    if empty_cells:
-        chosen_cell = random.choice(empty_cells)
-        chosen_cell.reveal()
-        minesweeper.minefield.cursor_position = chosen_cell.position
+    if empty_cells.size:
+        chosen_x, chosen_y = minefield.position(random.choice(empty_cells))
+        minefield.reveal(chosen_x, chosen_y)
+        minesweeper.minefield.cursor_x, minesweeper.minefield.cursor_y = chosen_x, chosen_y
     else:
-        minesweeper.minefield.cursor_position = Position(x=minefield.size.width // 2, y=minefield.size.height // 2)
+        minesweeper.minefield.cursor_x = minefield.size.width // 2
+        minesweeper.minefield.cursor_y = minefield.size.height // 2
     #########
     input_handler = InputHandler()
 
+    output = sys.stdout.buffer
+    top_left = minesweeper.minefield.top_left
     with term.cbreak(), term.hidden_cursor():
+        output.write(term.move_xy(top_left.x, top_left.y).encode() + str(minesweeper).encode())
+        # Everything pending was just drawn in full
+        minesweeper.minefield.clear_dirty()
         while not minesweeper.game_over and not minesweeper.victory:
-            with term.location(minesweeper.minefield.top_left.x, minesweeper.minefield.top_left.y):
-                print(minesweeper)
-            with term.location(minesweeper.minefield.cursor_position.x, minesweeper.minefield.cursor_position.y):
-                print(term.on_gray(str(minesweeper.minefield.cells[
-                    minesweeper.minefield.cursor_position.x, minesweeper.minefield.cursor_position.y
-                ])))
+            # One write and one flush per frame: the cells touched since the previous frame (including the old
+            # cursor cell), then the cursor on top
+            output.write(minesweeper.minefield.render_diff() + minesweeper.minefield.render_cursor())
+            output.flush()
 
             action: Optional[str] = input_handler.get_input()
 
@@ -252,36 +351,28 @@ def main() -> None:
                 case 'MOVE_BOTTOM_LEFT': minesweeper.minefield.move_cursor(dx=-1, dy=+1)
                 case 'MOVE_TOP_RIGHT': minesweeper.minefield.move_cursor(dx=+1, dy=-1)
                 case 'MOVE_BOTTOM_RIGHT': minesweeper.minefield.move_cursor(dx=+1, dy=+1)
-                case 'FLAG': minesweeper.minefield.flag(minesweeper.minefield.cursor_position)
+                case 'FLAG': minesweeper.minefield.flag(minesweeper.minefield.cursor_x, minesweeper.minefield.cursor_y)
                 case 'REVEAL':
-                    minesweeper.minefield.reveal(minesweeper.minefield.cursor_position)
-                    target_cell = minesweeper.minefield.cells[
-                        minesweeper.minefield.cursor_position.x, minesweeper.minefield.cursor_position.y
-                    ]
+                    minesweeper.minefield.reveal(minesweeper.minefield.cursor_x, minesweeper.minefield.cursor_y)
+                    target_cell = minesweeper.minefield.cell(
+                        minesweeper.minefield.cursor_x, minesweeper.minefield.cursor_y
+                    )
                     if target_cell.is_mine and target_cell.is_revealed:  # TODO: Need to check neighbour mines
                         minesweeper.game_over = True
-                    elif minesweeper.minefield.all_cells_revealed_except_mines():
+                    elif minesweeper.minefield.unrevealed_safe == 0:
                         minesweeper.victory = True
                 case _: pass
 
+        minesweeper.minefield.reveal_all()
         if minesweeper.game_over:
-            with term.location(minesweeper.minefield.top_left.x, minesweeper.minefield.top_left.y):
-                minesweeper.minefield.reveal_all()
-                print(minesweeper)
-            with term.location(
-                    0,
-                    minesweeper.minefield.top_left.y + minesweeper.minefield.size.height
-            ):
-                print(term.red + "Game Over! You revealed a mine.")
-        elif minesweeper.victory:
-            with term.location(minesweeper.minefield.top_left.x, minesweeper.minefield.top_left.y):
-                minesweeper.minefield.reveal_all()
-                print(minesweeper)
-            with term.location(
-                    0,
-                    minesweeper.minefield.top_left.y + minesweeper.minefield.size.height
-            ):
-                print(term.green + "Congratulations! You cleared the minefield.")
+            message = term.red + "Game Over! You revealed a mine."
+        else:
+            message = term.green + "Congratulations! You cleared the minefield."
+        output.write(
+            term.move_xy(top_left.x, top_left.y).encode() + str(minesweeper).encode()
+            + term.move_xy(0, top_left.y + minesweeper.minefield.size.height).encode() + (message + '\n').encode()
+        )
+        output.flush()
 
     with term.cbreak(), term.hidden_cursor():
         _ = term.inkey()